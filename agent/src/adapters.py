@@ -0,0 +1,22 @@
+from functools import lru_cache
+from typing import Any
+
+from pydantic import TypeAdapter
+from pydantic_ai.messages import ModelMessage, ModelMessagesTypeAdapter
+
+
+@lru_cache(maxsize=64)
+def get_type_adapter(tp: Any) -> TypeAdapter[Any]:
+    """Return the process-wide `TypeAdapter` for `tp`, building it on first use.
+
+    Building a TypeAdapter compiles its validator and serializer, so never create one
+    inside a request handler or tool; go through this function (or the constants below).
+    """
+    return TypeAdapter(tp)
+
+
+# Prefer `ModelMessagesTypeAdapter` (pydantic-ai's own list adapter) when handling a
+# whole history: one call into pydantic-core for the list is cheaper than one per message.
+ModelMessageAdapter: TypeAdapter[ModelMessage] = get_type_adapter(ModelMessage)
+
+__all__ = ["ModelMessageAdapter", "ModelMessagesTypeAdapter", "get_type_adapter"]
@@ -1,10 +1,12 @@
 from textwrap import dedent
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, PrivateAttr
 from pydantic_ai import Agent, RunContext
 from pydantic_ai.ag_ui import StateDeps
 from ag_ui.core import EventType, StateSnapshotEvent
 from pydantic_ai.models.openai import OpenAIResponsesModel
 
+from adapters import get_type_adapter
+
 # load environment variables
 from dotenv import load_dotenv
 load_dotenv()
@@ -22,11 +24,45 @@ class DatasetItem(BaseModel):
   status: str = Field(default="pending")
 
 
+TaskListAdapter = get_type_adapter(list[TaskItem])
+DatasetListAdapter = get_type_adapter(list[DatasetItem])
+
+
 class MLState(BaseModel):
   """Tracks ML tasks and datasets with statuses."""
   tasks: list[TaskItem] = Field(default_factory=list)
   datasets: list[DatasetItem] = Field(default_factory=list)
 
+  # Serialized `get_*` tool results, reused until the list is changed via the methods below.
+  _tasks_json: str | None = PrivateAttr(default=None)
+  _datasets_json: str | None = PrivateAttr(default=None)
+
+  def tasks_json(self) -> str:
+    if self._tasks_json is None:
+      self._tasks_json = TaskListAdapter.dump_json(self.tasks).decode()
+    return self._tasks_json
+
+  def datasets_json(self) -> str:
+    if self._datasets_json is None:
+      self._datasets_json = DatasetListAdapter.dump_json(self.datasets).decode()
+    return self._datasets_json
+
+  def add_tasks(self, tasks: list[TaskItem]) -> None:
+    self.tasks.extend(tasks)
+    self._tasks_json = None
+
+  def set_tasks(self, tasks: list[TaskItem]) -> None:
+    self.tasks = tasks
+    self._tasks_json = None
+
+  def add_datasets(self, datasets: list[DatasetItem]) -> None:
+    self.datasets.extend(datasets)
+    self._datasets_json = None
+
+  def set_datasets(self, datasets: list[DatasetItem]) -> None:
+    self.datasets = datasets
+    self._datasets_json = None
+
 # =====
 # Agent
 # =====
@@ -45,14 +81,14 @@ agent = Agent(
 # Tools
 # =====
 @agent.tool
-def get_tasks(ctx: RunContext[StateDeps[MLState]]) -> list[TaskItem]:
-  """Get the current list of ML tasks."""
+def get_tasks(ctx: RunContext[StateDeps[MLState]]) -> str:
+  """Get the current list of ML tasks as JSON."""
   print(f"🧠 Getting tasks: {ctx.deps.state.tasks}")
-  return ctx.deps.state.tasks
+  return ctx.deps.state.tasks_json()
 
 @agent.tool
 async def add_tasks(ctx: RunContext[StateDeps[MLState]], tasks: list[TaskItem]) -> StateSnapshotEvent:
-  ctx.deps.state.tasks.extend(tasks)
+  ctx.deps.state.add_tasks(tasks)
   return StateSnapshotEvent(
     type=EventType.STATE_SNAPSHOT,
     snapshot=ctx.deps.state,
@@ -60,7 +96,7 @@ async def add_tasks(ctx: RunContext[StateDeps[MLState]], tasks: list[TaskItem])
 
 @agent.tool
 async def set_tasks(ctx: RunContext[StateDeps[MLState]], tasks: list[TaskItem]) -> StateSnapshotEvent:
-  ctx.deps.state.tasks = tasks
+  ctx.deps.state.set_tasks(tasks)
   return StateSnapshotEvent(
     type=EventType.STATE_SNAPSHOT,
     snapshot=ctx.deps.state,
@@ -68,15 +104,15 @@ async def set_tasks(ctx: RunContext[StateDeps[MLState]], tasks: list[TaskItem])
 
 
 @agent.tool
-def get_datasets(ctx: RunContext[StateDeps[MLState]]) -> list[DatasetItem]:
-  """Get the current list of datasets."""
+def get_datasets(ctx: RunContext[StateDeps[MLState]]) -> str:
+  """Get the current list of datasets as JSON."""
   print(f"📊 Getting datasets: {ctx.deps.state.datasets}")
-  return ctx.deps.state.datasets
+  return ctx.deps.state.datasets_json()
 
 
 @agent.tool
 async def add_datasets(ctx: RunContext[StateDeps[MLState]], datasets: list[DatasetItem]) -> StateSnapshotEvent:
-  ctx.deps.state.datasets.extend(datasets)
+  ctx.deps.state.add_datasets(datasets)
   return StateSnapshotEvent(
     type=EventType.STATE_SNAPSHOT,
     snapshot=ctx.deps.state,
@@ -85,7 +121,7 @@ async def add_datasets(ctx: RunContext[StateDeps[MLState]], datasets: list[Datas
 
 @agent.tool
 async def set_datasets(ctx: RunContext[StateDeps[MLState]], datasets: list[DatasetItem]) -> StateSnapshotEvent:
-  ctx.deps.state.datasets = datasets
+  ctx.deps.state.set_datasets(datasets)
   return StateSnapshotEvent(
     type=EventType.STATE_SNAPSHOT,
     snapshot=ctx.deps.state,
@@ -1,39 +1,46 @@
 from __future__ import annotations
 
 import logging
+import os
 import uuid
 from contextlib import asynccontextmanager
+from datetime import datetime
+from types import MappingProxyType
 from typing import Any
 
 from ag_ui.core import RunAgentInput
 from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import StreamingResponse
-from sqlalchemy import delete, func
-from sqlmodel import SQLModel, Session, select
+from fastapi.responses import ORJSONResponse, StreamingResponse
+from sqlalchemy import Text, cast, func, insert, literal
+from sqlalchemy.dialects.postgresql import JSONB, aggregate_order_by, insert as pg_insert
+from sqlmodel import SQLModel, select
 
 from pydantic_ai.ag_ui import SSE_CONTENT_TYPE, run_ag_ui
-from pydantic import TypeAdapter
-from pydantic_ai.messages import ModelMessage, ModelRequest, ModelResponse, UserPromptPart
-from pydantic_ai.ui.ag_ui._adapter import AGUIAdapter
 
+from adapters import ModelMessagesTypeAdapter
 from agent import MLState, StateDeps, agent
-from db import engine
+from db import AsyncSessionLocal, async_engine, engine
 from models import Message, State, Thread
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger("threads")
 
-ModelMessageAdapter = TypeAdapter(ModelMessage)
+# Default state for threads without a stored one, built once instead of per request.
+_EMPTY_ML_STATE = MappingProxyType(MLState().model_dump())
+
+# How many stored messages (roughly) are replayed to the model on each run.
+_HISTORY_LIMIT = int(os.getenv("HISTORY_LIMIT", "20"))
 
 
 @asynccontextmanager
 async def lifespan(_app: FastAPI):
     SQLModel.metadata.create_all(engine)
     yield
+    await async_engine.dispose()
 
 
-app = FastAPI(lifespan=lifespan)
+app = FastAPI(lifespan=lifespan, default_response_class=ORJSONResponse)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["http://localhost:3000", "http://127.0.0.1:3000"],
@@ -43,94 +50,132 @@ app.add_middleware(
 
 
 @app.get("/threads")
-def list_threads() -> list[dict[str, Any]]:
-    with Session(engine) as session:
-        threads = session.exec(select(Thread).order_by(Thread.updated_at.desc())).all()
-        response: list[dict[str, Any]] = []
-        for thread in threads:
-            message_count = session.exec(
-                select(func.count(Message.id)).where(Message.thread_id == thread.id)
-            ).one()
-            response.append(
-                {
-                    "thread_id": str(thread.id),
-                    "title": thread.title,
-                    "message_count": message_count,
-                }
+async def list_threads() -> list[dict[str, Any]]:
+    async with AsyncSessionLocal() as session:
+        rows = (
+            await session.exec(
+                select(Thread.id, Thread.title, func.count(Message.id))
+                .join(Message, Message.thread_id == Thread.id, isouter=True)
+                .group_by(Thread.id)
+                .order_by(Thread.updated_at.desc())
             )
-        return response
-
-
-def _model_messages_to_chat(messages: list[ModelMessage], thread_id: str) -> list[dict[str, Any]]:
-    chat_messages: list[dict[str, Any]] = []
-    for index, message in enumerate(messages):
-        message_id = f"{thread_id}-history-{index}"
-        if isinstance(message, ModelRequest):
-            for part in message.parts:
-                if isinstance(part, UserPromptPart):
-                    chat_messages.append(
-                        {
-                            "id": message_id,
-                            "role": "user",
-                            "content": part.content,
-                        }
-                    )
-                    break
-        elif isinstance(message, ModelResponse):
-            text = message.text
-            if text:
-                chat_messages.append(
-                    {
-                        "id": message_id,
-                        "role": "assistant",
-                        "content": text,
-                    }
-                )
-    return chat_messages
+        ).all()
+        return [
+            {
+                "thread_id": str(thread_id),
+                "title": title,
+                "message_count": message_count,
+            }
+            for thread_id, title, message_count in rows
+        ]
+
+
+def _response_text(parts: list[dict[str, Any]]) -> str | None:
+    # Mirrors `ModelResponse.text`: adjacent text parts are joined directly,
+    # text separated by other parts is joined with a blank line.
+    texts: list[str] = []
+    last_kind = None
+    for part in parts:
+        kind = part["part_kind"]
+        if kind == "text":
+            if last_kind == "text":
+                texts[-1] += part["content"]
+            else:
+                texts.append(part["content"])
+        last_kind = kind
+    return "\n\n".join(texts) if texts else None
+
+
+def _chat_entry(message: dict[str, Any]) -> tuple[str, Any] | None:
+    # Returns the (role, content) a stored message contributes to the chat, if any.
+    kind = message.get("kind")
+    if kind == "request":
+        for part in message["parts"]:
+            if part["part_kind"] == "user-prompt":
+                return "user", part["content"]
+    elif kind == "response":
+        text = _response_text(message["parts"])
+        if text:
+            return "assistant", text
+    return None
+
+
+def _is_chat_message(message: dict[str, Any]) -> bool:
+    return _chat_entry(message) is not None
+
+
+def _is_user_prompt(message: dict[str, Any]) -> bool:
+    return message.get("kind") == "request" and any(
+        part["part_kind"] == "user-prompt" for part in message["parts"]
+    )
+
+
+def _trim_history(messages: list[dict[str, Any]], limit: int) -> list[dict[str, Any]]:
+    # Keeps about the last `limit` stored messages. The cut is moved to a user prompt so
+    # a tool return is never replayed without the call that produced it.
+    if len(messages) <= limit:
+        return messages
+    cut = len(messages) - limit
+    for start in (*range(cut, len(messages)), *range(cut - 1, -1, -1)):
+        if _is_user_prompt(messages[start]):
+            return messages[start:]
+    return messages
+
+
+def _model_messages_to_chat(
+    messages: list[dict[str, Any]], thread_id: str
+) -> list[dict[str, Any]]:
+    # Works on the stored `ModelMessage` JSON directly; the rows were serialized by the
+    # adapters in `adapters.py`, so validating them again is not needed here.
+    return [
+        {"id": f"{thread_id}-history-{index}", "role": entry[0], "content": entry[1]}
+        for index, message in enumerate(messages)
+        if (entry := _chat_entry(message)) is not None
+    ]
 
 
 @app.get("/threads/{thread_id}")
-def get_thread(thread_id: str) -> dict[str, Any]:
-    with Session(engine) as session:
+async def get_thread(thread_id: str) -> dict[str, Any]:
+    async with AsyncSessionLocal() as session:
         thread_uuid = _parse_thread_id(thread_id)
         if not thread_uuid:
             return {
                 "thread_id": thread_id,
                 "title": "New thread",
-                "state": MLState().model_dump(),
+                "state": dict(_EMPTY_ML_STATE),
             }
-        thread = session.get(Thread, thread_uuid)
+        thread = await session.get(Thread, thread_uuid)
         if not thread:
             return {
                 "thread_id": thread_id,
                 "title": "New thread",
-                "state": MLState().model_dump(),
+                "state": dict(_EMPTY_ML_STATE),
             }
-        state = session.exec(select(State).where(State.thread_id == thread.id)).first()
+        state = (await session.exec(select(State).where(State.thread_id == thread.id))).first()
         return {
             "thread_id": str(thread.id),
             "title": thread.title,
-            "state": state.state_json if state else MLState().model_dump(),
+            "state": state.state_json if state else dict(_EMPTY_ML_STATE),
         }
 
 
 @app.get("/threads/{thread_id}/messages")
-def get_thread_messages(thread_id: str) -> list[dict[str, Any]]:
-    with Session(engine) as session:
+async def get_thread_messages(thread_id: str) -> list[dict[str, Any]]:
+    async with AsyncSessionLocal() as session:
         thread_uuid = _parse_thread_id(thread_id)
         if not thread_uuid:
             return []
-        thread = session.get(Thread, thread_uuid)
+        thread = await session.get(Thread, thread_uuid)
         if not thread:
             return []
-        stored_messages = session.exec(
-            select(Message).where(Message.thread_id == thread.id).order_by(Message.created_at)
+        stored_messages = (
+            await session.exec(
+                select(Message).where(Message.thread_id == thread.id).order_by(Message.seq)
+            )
         ).all()
-        model_messages = [
-            ModelMessageAdapter.validate_python(message.message_json)
-            for message in stored_messages
-        ]
-        chat_messages = _model_messages_to_chat(model_messages, thread_id)
+        chat_messages = _model_messages_to_chat(
+            [message.message_json for message in stored_messages], thread_id
+        )
         logger.info("Thread %s history requested, returning %s messages", thread_id, len(chat_messages))
         return chat_messages
 
@@ -138,60 +183,96 @@ def get_thread_messages(thread_id: str) -> list[dict[str, Any]]:
 @app.post("/agent")
 async def ag_ui_endpoint(request: Request) -> StreamingResponse:
     run_input = RunAgentInput.model_validate_json(await request.body())
-    session = Session(engine)
     thread_uuid = _parse_thread_id(run_input.thread_id)
     if not thread_uuid:
         thread_uuid = uuid.uuid5(uuid.NAMESPACE_URL, run_input.thread_id)
-    thread = session.get(Thread, thread_uuid)
-    if not thread:
-        thread = Thread(id=thread_uuid, user_id="demo-user", title=f"Thread {run_input.thread_id}")
-        session.add(thread)
-        session.add(State(thread_id=thread.id, state_json=MLState().model_dump()))
-        session.commit()
-        logger.info("Thread %s created", run_input.thread_id)
-
-    state_row = session.exec(select(State).where(State.thread_id == thread.id)).first()
-    stored_state = state_row.state_json if state_row else MLState().model_dump()
-
-    stored_messages = session.exec(
-        select(Message).where(Message.thread_id == thread.id).order_by(Message.created_at)
-    ).all()
-    model_messages = [
-        ModelMessageAdapter.validate_python(message.message_json)
-        for message in stored_messages
-    ]
-    stored_agui_count = len(_model_messages_to_chat(model_messages, str(thread.id)))
+
+    # Only hold a pooled connection while loading; the stream itself can run for
+    # many seconds and `on_complete` opens its own short-lived session.
+    async with AsyncSessionLocal() as session:
+        # Thread, state and ordered history in one round trip.
+        history = (
+            select(func.jsonb_agg(aggregate_order_by(Message.message_json, Message.seq), type_=JSONB))
+            .where(Message.thread_id == Thread.id)
+            .scalar_subquery()
+        )
+        row = (
+            await session.exec(
+                select(Thread.id, cast(State.state_json, Text), history)
+                .outerjoin(State, State.thread_id == Thread.id)
+                .where(Thread.id == thread_uuid)
+            )
+        ).first()
+        if row:
+            thread_id, stored_state_json, stored_messages = row
+        else:
+            thread = Thread(id=thread_uuid, user_id="demo-user", title=f"Thread {run_input.thread_id}")
+            session.add(thread)
+            session.add(State(thread_id=thread.id, state_json=dict(_EMPTY_ML_STATE)))
+            await session.commit()
+            logger.info("Thread %s created", run_input.thread_id)
+            thread_id, stored_state_json, stored_messages = thread.id, None, None
+
+    stored_messages = stored_messages or []
+    stored_count = len(stored_messages)
+    # Only the replayed tail is validated into pydantic-ai messages.
+    message_history = ModelMessagesTypeAdapter.validate_python(
+        _trim_history(stored_messages, _HISTORY_LIMIT)
+    )
+    stored_agui_count = sum(1 for message in stored_messages if _is_chat_message(message))
     if run_input.messages and len(run_input.messages) >= stored_agui_count:
         new_agui_messages = run_input.messages[stored_agui_count:]
     else:
         new_agui_messages = run_input.messages
 
-    incoming_messages = AGUIAdapter.load_messages(new_agui_messages) if new_agui_messages else []
-    message_history = [*model_messages, *incoming_messages]
-
+    # `run_ag_ui` appends the converted `run_input.messages` to `message_history` itself.
     run_input = run_input.model_copy(update={"messages": new_agui_messages})
 
-    deps = StateDeps(MLState.model_validate(stored_state))
-
-    def on_complete(result: Any) -> None:
-        session.exec(delete(Message).where(Message.thread_id == thread.id))
-        for message in result.all_messages():
-            session.add(
-                Message(
-                    thread_id=thread.id,
-                    message_json=ModelMessageAdapter.dump_python(message, mode="json"),
+    stored_state = (
+        MLState.model_validate_json(stored_state_json) if stored_state_json else MLState()
+    )
+    stored_state_dump = stored_state.model_dump_json()
+    deps = StateDeps(stored_state)
+
+    async def on_complete(result: Any) -> None:
+        new_messages = result.all_messages()[len(message_history):]
+        state_dump = deps.state.model_dump_json()
+        # The snapshot is only rewritten when the run actually changed it.
+        state_changed = state_dump != stored_state_dump
+        if not new_messages and not state_changed:
+            return
+        async with AsyncSessionLocal() as session:
+            if new_messages:
+                await session.exec(
+                    insert(Message),
+                    params=[
+                        {"thread_id": thread_id, "message_json": message_json, "seq": seq}
+                        for seq, message_json in enumerate(
+                            ModelMessagesTypeAdapter.dump_python(new_messages, mode="json"),
+                            start=stored_count,
+                        )
+                    ],
                 )
-            )
-        if state_row:
-            state_row.state_json = deps.state.model_dump()
-            session.add(state_row)
-        else:
-            session.add(State(thread_id=thread.id, state_json=deps.state.model_dump()))
-        session.commit()
+            if state_changed:
+                upsert_state = pg_insert(State).values(
+                    thread_id=thread_id,
+                    state_json=cast(literal(state_dump, Text), JSONB),
+                )
+                await session.exec(
+                    upsert_state.on_conflict_do_update(
+                        index_elements=[State.thread_id],
+                        set_={
+                            "state_json": upsert_state.excluded.state_json,
+                            "updated_at": datetime.utcnow(),
+                        },
+                    )
+                )
+            await session.commit()
         logger.info(
-            "Thread %s stored messages=%s state_tasks=%s datasets=%s",
+            "Thread %s stored new_messages=%s state_changed=%s state_tasks=%s datasets=%s",
             run_input.thread_id,
-            len(result.all_messages()),
+            len(new_messages),
+            state_changed,
             len(deps.state.tasks),
             len(deps.state.datasets),
         )
@@ -206,14 +287,7 @@ async def ag_ui_endpoint(request: Request) -> StreamingResponse:
         on_complete=on_complete,
     )
 
-    async def stream_with_session():
-        try:
-            async for event in stream:
-                yield event
-        finally:
-            session.close()
-
-    return StreamingResponse(stream_with_session(), media_type=accept)
+    return StreamingResponse(stream, media_type=accept)
 
 
 def _parse_thread_id(thread_id: str) -> uuid.UUID | None:
@@ -224,6 +298,19 @@ def _parse_thread_id(thread_id: str) -> uuid.UUID | None:
 
 
 if __name__ == "__main__":
+    import sys
+
     import uvicorn
 
-    uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True)
+    # DEV=1 (set by scripts/run-agent.*) keeps the single auto-reloading process;
+    # otherwise run one worker per CPU on uvloop + httptools.
+    dev = os.getenv("DEV") == "1"
+    uvicorn.run(
+        "main:app",
+        host="0.0.0.0",
+        port=8000,
+        reload=dev,
+        workers=None if dev else os.cpu_count(),
+        loop="asyncio" if sys.platform == "win32" else "uvloop",
+        http="httptools",
+    )
@@ -1,18 +1,19 @@
-import json
 import uuid
 from datetime import datetime
 from typing import Any, Dict, List, Optional
 
-from sqlalchemy import Column
+from sqlalchemy import Column, Index
 from sqlalchemy.dialects.postgresql import JSONB
 from sqlmodel import Field, Relationship, SQLModel
 
 class Message(SQLModel, table=True):
     __tablename__ = "messages"
+    __table_args__ = (Index("ix_messages_thread_seq", "thread_id", "seq"),)
 
     id: uuid.UUID = Field(default_factory=uuid.uuid4, primary_key=True)
     thread_id: uuid.UUID = Field(foreign_key="threads.id", nullable=False)
     message_json: Dict[str, Any] = Field(sa_column=Column(JSONB, nullable=False))
+    seq: int = Field(default=0, nullable=False)
     created_at: datetime = Field(default_factory=datetime.utcnow, nullable=False)
 
     thread: "Thread" = Relationship(back_populates="messages")
@@ -58,21 +59,20 @@ class Thread(SQLModel, table=True):
         nullable=False,
         sa_column_kwargs={"onupdate": datetime.utcnow},
     )
-    metadata_json: Optional[str] = Field(
-        default=None, sa_column=JSONB, alias="thread_metadata"
+    metadata_json: Optional[Dict[str, Any]] = Field(
+        default=None, sa_column=Column(JSONB, nullable=True), alias="thread_metadata"
     )
 
     @property
     def thread_metadata(self) -> Optional[ThreadMetadata]:
         if self.metadata_json:
-            data = json.loads(self.metadata_json)
-            return ThreadMetadata(**data)
+            return ThreadMetadata.model_validate(self.metadata_json)
         return None
 
     @thread_metadata.setter
     def thread_metadata(self, value: Optional[ThreadMetadata]):
         if value:
-            self.metadata_json = json.dumps(value.model_dump())
+            self.metadata_json = value.model_dump(mode="json")
         else:
             self.metadata_json = None
 
@@ -3,17 +3,16 @@ from __future__ import annotations
 from datetime import datetime
 import argparse
 
-from pydantic import TypeAdapter
-from pydantic_ai.messages import ModelMessage, ModelRequest, ModelResponse, TextPart, UserPromptPart
-from sqlmodel import SQLModel, Session, select
+from pydantic_ai.messages import ModelRequest, ModelResponse, TextPart, UserPromptPart
+from sqlalchemy import insert
+from sqlmodel import SQLModel, select
 
-from db import engine
+from adapters import ModelMessagesTypeAdapter
+from db import SessionLocal, engine
 import uuid
 
 from models import Message, State, Thread
 
-ModelMessageAdapter = TypeAdapter(ModelMessage)
-
 
 def _user_message(content: str) -> ModelRequest:
     return ModelRequest(parts=[UserPromptPart(content=content, timestamp=datetime.utcnow())])
@@ -110,38 +109,37 @@ def seed(drop_all: bool = False) -> None:
     if drop_all:
         SQLModel.metadata.drop_all(engine)
     SQLModel.metadata.create_all(engine)
-    with Session(engine) as session:
-        existing = {
-            thread.id for thread in session.exec(select(Thread.id)).all()
-        }
+    with SessionLocal() as session:
+        existing = set(session.exec(select(Thread.id)).all())
+        threads: list[dict] = []
+        states: list[dict] = []
+        messages: list[dict] = []
         for thread_data in _seed_threads():
-            if thread_data["thread_id"] in existing:
+            thread_id = uuid.UUID(thread_data["thread_id"])
+            if thread_id in existing:
                 continue
 
-            thread = Thread(
-                id=uuid.UUID(thread_data["thread_id"]),
-                user_id="seed-user",
-                title=thread_data["title"],
-            )
-            session.add(thread)
-            session.add(State(thread_id=thread.id, state_json=thread_data["state"]))
-
-            for index, (role, content) in enumerate(thread_data["messages"]):
-                if role == "user":
-                    message = _user_message(content)
-                else:
-                    message = _assistant_message(content)
-
-                session.add(
-                    Message(
-                        thread_id=thread.id,
-                        message_json=ModelMessageAdapter.dump_python(message, mode="json"),
-                    )
+            threads.append({"id": thread_id, "user_id": "seed-user", "title": thread_data["title"]})
+            states.append({"thread_id": thread_id, "state_json": thread_data["state"]})
+
+            model_messages = [
+                _user_message(content) if role == "user" else _assistant_message(content)
+                for role, content in thread_data["messages"]
+            ]
+            messages.extend(
+                {"thread_id": thread_id, "message_json": message_json, "seq": seq}
+                for seq, message_json in enumerate(
+                    ModelMessagesTypeAdapter.dump_python(model_messages, mode="json")
                 )
+            )
 
+        # One executemany INSERT per table; threads first for the foreign keys.
+        if threads:
+            session.exec(insert(Thread), params=threads)
+            session.exec(insert(State), params=states)
+            session.exec(insert(Message), params=messages)
         session.commit()
 
-
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Seed Postgres with demo ML threads.")
     parser.add_argument(
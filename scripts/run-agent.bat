@@ -2,5 +2,6 @@
 REM Navigate to the agent directory
 cd /d %~dp0\..\agent
 
-REM Run the agent using uv
+REM Run the agent using uv (DEV=1 enables auto-reload)
+set DEV=1
 uv run src/main.py 
\ No newline at end of file
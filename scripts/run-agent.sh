@@ -3,5 +3,5 @@
 # Navigate to the agent directory
 cd "$(dirname "$0")/../agent" || exit 1
 
-# Run the agent using uv
-uv run src/main.py
+# Run the agent using uv (DEV=1 enables auto-reload)
+DEV=1 uv run src/main.py